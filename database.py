@@ -1,101 +1,181 @@
+import os
 import sqlite3
 import datetime
-from typing import List, Dict, Optional
+from contextlib import contextmanager
+from typing import List, Dict, Optional, Tuple
+
+# Bump whenever schema.sql changes so existing databases pick it up
+SCHEMA_VERSION = 5
+
+with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'schema.sql'), 'r') as f:
+    _SCHEMA = f.read()
+
+# SQL for the hot insert paths, kept as constants so sqlite3's statement cache is reused
+_SQL_ADD_USER = "INSERT INTO users (username, email) VALUES (?, ?)"
+_SQL_ADD_FEED = "INSERT INTO rss_feeds (feed_url, feed_name) VALUES (?, ?)"
+_SQL_SUBSCRIBE = "INSERT INTO user_feeds (user_id, feed_id) VALUES (?, ?)"
+_SQL_ADD_NEWS = (
+    "INSERT OR IGNORE INTO news_items (feed_id, title, link, description, pub_date) "
+    "VALUES (?, ?, ?, ?, ?)"
+)
+_SQL_MARK_DELIVERED = "INSERT OR IGNORE INTO news_delivery (user_id, news_id) VALUES (?, ?)"
+
+def _apply_pragmas(conn: sqlite3.Connection):
+    """Apply the WAL journal and performance pragmas to a connection"""
+    # WAL mode is stored in the database file, so it sticks after the first open
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("PRAGMA cache_size=-65536")
+    conn.execute("PRAGMA mmap_size=268435456")
+    conn.execute("PRAGMA busy_timeout=5000")
 
 class Database:
     def __init__(self, db_path: str = "news_database.db"):
         self.db_path = db_path
-        self.conn = sqlite3.connect(db_path)
-        self.cursor = self.conn.cursor()
+        # check_same_thread=False so calls can be offloaded with asyncio.to_thread
+        self.conn = sqlite3.connect(db_path, check_same_thread=False, cached_statements=256)
+        # Rows map column names in C, so results convert with dict(row) and no per-row zip
+        self.conn.row_factory = sqlite3.Row
+        self._in_tx = False
         self._create_tables()
 
     def _create_tables(self):
         """Create database tables if they don't exist"""
-        with open('schema.sql', 'r') as f:
-            schema = f.read()
-        self.cursor.executescript(schema)
+        _apply_pragmas(self.conn)
+        # Skip the schema script once this database is already at the current version
+        version = self.conn.execute("PRAGMA user_version").fetchone()[0]
+        if version >= SCHEMA_VERSION:
+            return
+        self.conn.executescript(_SCHEMA)
+        self.conn.execute("ANALYZE")
+        self.conn.execute(f"PRAGMA user_version={SCHEMA_VERSION}")
         self.conn.commit()
 
+    @contextmanager
+    def bulk(self):
+        """Group several writes into a single transaction"""
+        self.conn.execute("BEGIN IMMEDIATE")
+        self._in_tx = True
+        try:
+            yield self
+            self.conn.commit()
+        except Exception:
+            self.conn.rollback()
+            raise
+        finally:
+            self._in_tx = False
+
+    def _commit(self):
+        """Commit unless the write is part of a bulk() transaction"""
+        if not self._in_tx:
+            self.conn.commit()
+
     def add_user(self, username: str, email: str) -> int:
         """Add a new user to the database"""
-        self.cursor.execute(
-            "INSERT INTO users (username, email) VALUES (?, ?)",
+        cur = self.conn.execute(
+            _SQL_ADD_USER,
             (username, email)
         )
-        self.conn.commit()
-        return self.cursor.lastrowid
+        self._commit()
+        return cur.lastrowid
 
     def add_rss_feed(self, feed_url: str, feed_name: str) -> int:
         """Add a new RSS feed to the database"""
-        self.cursor.execute(
-            "INSERT INTO rss_feeds (feed_url, feed_name) VALUES (?, ?)",
+        cur = self.conn.execute(
+            _SQL_ADD_FEED,
             (feed_url, feed_name)
         )
-        self.conn.commit()
-        return self.cursor.lastrowid
+        self._commit()
+        return cur.lastrowid
 
     def subscribe_user_to_feed(self, user_id: int, feed_id: int):
         """Subscribe a user to an RSS feed"""
-        self.cursor.execute(
-            "INSERT INTO user_feeds (user_id, feed_id) VALUES (?, ?)",
+        self.conn.execute(
+            _SQL_SUBSCRIBE,
             (user_id, feed_id)
         )
-        self.conn.commit()
+        self._commit()
 
-    def add_news_item(self, feed_id: int, title: str, link: str, description: str, pub_date: datetime.datetime) -> int:
-        """Add a new news item to the database"""
-        self.cursor.execute(
-            """INSERT INTO news_items 
-               (feed_id, title, link, description, pub_date) 
-               VALUES (?, ?, ?, ?, ?)""",
+    def add_news_item(self, feed_id: int, title: str, link: str, description: str, pub_date: datetime.datetime) -> Optional[int]:
+        """Add a new news item to the database, returning None if the link already exists"""
+        cur = self.conn.execute(
+            _SQL_ADD_NEWS,
             (feed_id, title, link, description, pub_date)
         )
-        self.conn.commit()
-        return self.cursor.lastrowid
+        self._commit()
+        return cur.lastrowid if cur.rowcount else None
+
+    def add_news_items_bulk(self, rows: List[Tuple]) -> int:
+        """Add many news items given as (feed_id, title, link, description, pub_date) tuples.
+
+        Items whose link is already stored are skipped; returns how many were added.
+        """
+        cur = self.conn.executemany(
+            _SQL_ADD_NEWS,
+            rows
+        )
+        self._commit()
+        return cur.rowcount
 
     def mark_news_delivered(self, user_id: int, news_id: int):
         """Mark a news item as delivered to a user"""
-        self.cursor.execute(
-            "INSERT INTO news_delivery (user_id, news_id) VALUES (?, ?)",
-            (user_id, news_id)
+        self.mark_news_delivered_bulk(user_id, [news_id])
+
+    def mark_news_delivered_bulk(self, user_id: int, news_ids: List[int]):
+        """Mark several news items as delivered to a user in one transaction"""
+        self.conn.executemany(
+            _SQL_MARK_DELIVERED,
+            [(user_id, news_id) for news_id in news_ids]
         )
-        self.conn.commit()
+        self._commit()
+
+    def get_undelivered_news(self, user_id: int, limit: Optional[int] = None,
+                             before_pub_date: Optional[str] = None, before_news_id: Optional[int] = None) -> List[Dict]:
+        """Get undelivered news items for a user, newest first (all of them unless limit is given).
 
-    def get_undelivered_news(self, user_id: int) -> List[Dict]:
-        """Get all undelivered news items for a user"""
-        self.cursor.execute("""
+        To get the next page, pass the pub_date and news_id of the previous page's last item
+        as before_pub_date and before_news_id (pub_date alone isn't unique).
+        """
+        cur = self.conn.execute("""
             SELECT ni.news_id, ni.title, ni.link, ni.description, ni.pub_date, rf.feed_name
-            FROM news_items ni
-            JOIN rss_feeds rf ON ni.feed_id = rf.feed_id
-            JOIN user_feeds uf ON rf.feed_id = uf.feed_id
-            LEFT JOIN news_delivery nd ON ni.news_id = nd.news_id AND nd.user_id = ?
-            WHERE uf.user_id = ? AND nd.delivery_id IS NULL
-            ORDER BY ni.pub_date DESC
-        """, (user_id, user_id))
-        
-        columns = [description[0] for description in self.cursor.description]
-        return [dict(zip(columns, row)) for row in self.cursor.fetchall()]
+            FROM user_feeds uf
+            JOIN news_items ni ON ni.feed_id = uf.feed_id
+            JOIN rss_feeds rf ON rf.feed_id = uf.feed_id
+            WHERE uf.user_id = :user_id AND NOT EXISTS (
+                SELECT 1 FROM news_delivery nd
+                WHERE nd.news_id = ni.news_id AND nd.user_id = :user_id
+            )
+            AND (:before_pub_date IS NULL OR (ni.pub_date, ni.news_id) < (:before_pub_date, :before_news_id))
+            ORDER BY ni.pub_date DESC, ni.news_id DESC
+            LIMIT :limit
+        """, {
+            'user_id': user_id,
+            'before_pub_date': before_pub_date,
+            'before_news_id': before_news_id,
+            # A negative LIMIT means no limit in SQLite
+            'limit': -1 if limit is None else limit
+        })
+        return [dict(row) for row in cur.fetchall()]
 
     def get_user_feeds(self, user_id: int) -> List[Dict]:
         """Get all RSS feeds a user is subscribed to"""
-        self.cursor.execute("""
+        cur = self.conn.execute("""
             SELECT rf.feed_id, rf.feed_url, rf.feed_name, rf.last_updated
             FROM rss_feeds rf
             JOIN user_feeds uf ON rf.feed_id = uf.feed_id
             WHERE uf.user_id = ?
         """, (user_id,))
-        
-        columns = [description[0] for description in self.cursor.description]
-        return [dict(zip(columns, row)) for row in self.cursor.fetchall()]
+        return [dict(row) for row in cur.fetchall()]
 
     def update_feed_last_updated(self, feed_id: int):
         """Update the last_updated timestamp for a feed"""
-        self.cursor.execute(
+        self.conn.execute(
             "UPDATE rss_feeds SET last_updated = CURRENT_TIMESTAMP WHERE feed_id = ?",
             (feed_id,)
         )
-        self.conn.commit()
+        self._commit()
 
     def close(self):
         """Close the database connection"""
-        self.conn.close() 
\ No newline at end of file
+        self.conn.close()
@@ -1,8 +1,18 @@
 import asyncio
+import functools
 import edge_tts
 import os
+from pathlib import Path
 from typing import Optional, Callable, Any
 
+def _ensure_no_running_loop(func_name: str):
+    """Raise if called from inside a running event loop, where asyncio.run cannot be used."""
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return
+    raise RuntimeError(f"{func_name}() cannot be called from a running event loop; await the async version instead")
+
 class EdgeTTS:
     def __init__(self, voice: str = "en-US-AriaNeural", rate: str = "+0%", volume: str = "+0%"):
         """
@@ -37,14 +47,14 @@ class EdgeTTS:
             communicate = edge_tts.Communicate(text, voice_to_use, rate=self.rate, volume=self.volume)
             
             if stream_callback:
-                # Create a temporary file to store the audio
-                with open(output_file, 'wb') as file:
-                    async for chunk in communicate.stream():
-                        if chunk["type"] == "audio":
-                            audio_data = chunk["data"]
-                            file.write(audio_data)
-                            if stream_callback:
-                                await stream_callback(audio_data)
+                # Buffer the audio in memory and write the file once at the end
+                buffer = bytearray()
+                async for chunk in communicate.stream():
+                    if chunk["type"] == "audio":
+                        audio_data = chunk["data"]
+                        buffer.extend(audio_data)
+                        await stream_callback(audio_data)
+                await asyncio.to_thread(Path(output_file).write_bytes, bytes(buffer))
             else:
                 await communicate.save(output_file)
                 
@@ -65,16 +75,25 @@ class EdgeTTS:
             
         Returns:
             bool: True if synthesis was successful, False otherwise
+            
+        Raises:
+            RuntimeError: If called from a running event loop (use synthesize_async instead)
         """
+        _ensure_no_running_loop("synthesize")
         return asyncio.run(self.synthesize_async(text, output_file, voice, stream_callback))
 
+@functools.lru_cache(maxsize=1)
 def get_available_voices() -> list:
     """
-    Get a list of available voices.
+    Get a list of available voices. The result is cached since the voice list is static.
     
     Returns:
         list: List of available voice names
+        
+    Raises:
+        RuntimeError: If called from a running event loop (await edge_tts.list_voices() instead)
     """
+    _ensure_no_running_loop("get_available_voices")
     return asyncio.run(edge_tts.list_voices())
 
 # https://gist.github.com/BettyJJ/17cbaa1de96235a7f5773b8690a20462
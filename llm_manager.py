@@ -1,21 +1,61 @@
+import asyncio
+import hashlib
 import logging
 import os
-from typing import Dict, Optional, List
+import httpx
+from collections import OrderedDict
+from typing import Dict, List
 from dotenv import load_dotenv
 from langchain_openai import ChatOpenAI
 from langchain.prompts import ChatPromptTemplate
-from langchain.chains import LLMChain
-from langchain.cache import InMemoryCache
+from langchain.cache import SQLiteCache
 import langchain
 from langchain.callbacks import get_openai_callback
 from langchain_core.output_parsers import StrOutputParser
-from langchain_core.runnables import RunnablePassthrough
+
+try:
+    import h2  # noqa: F401 - enables HTTP/2 support in httpx
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
 
 # Load environment variables
 load_dotenv()
 
-# Enable caching
-langchain.llm_cache = InMemoryCache()
+# LLM response cache file; defaults to next to this module rather than the working directory
+LLM_CACHE_PATH = os.getenv(
+    'LLM_CACHE_PATH',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), '.langchain.db')
+)
+
+# Enable caching (persisted on disk so responses survive restarts)
+langchain.llm_cache = SQLiteCache(database_path=LLM_CACHE_PATH)
+
+# Translations kept in memory; least recently used ones are evicted beyond this
+# (responses also persist in the SQLite LLM cache)
+TRANSLATION_CACHE_SIZE = 1024
+
+# Prompt templates, parsed once at import time and shared by all LLMManager instances
+TRANSLATION_PROMPT = ChatPromptTemplate.from_template(
+    "Translate the following text from {source_lang} to {target_lang} conceptually. "
+    "\n\n{text}"
+)
+
+SUMMARIZATION_PROMPT = ChatPromptTemplate.from_template(
+    "Summarize the following text in about {max_length} characters. "
+    "Focus on the main points and key information:\n\n{text}"
+)
+
+# Only {text} varies here, so plain str.format is enough and skips LangChain templating
+LANGUAGE_DETECTION_PROMPT = (
+    "Identify the language of the following text and respond with just the ISO 639-1 language code "
+    "(e.g., 'en' for English):\n\n{text}"
+)
+
+NEWS_DIGEST_PROMPT = ChatPromptTemplate.from_template(
+    "Create a brief news digest in {target_lang} based on these news items:\n\n{news_text}\n\n"
+    "Format the digest as a concise summary of the main developments."
+)
 
 class LLMManager:
     """Manager for LLM-based operations using LangChain."""
@@ -33,38 +73,37 @@ class LLMManager:
         )
         self.logger = logging.getLogger(__name__)
         
+        # Shared HTTP client so every request reuses the same keep-alive connections;
+        # with HTTP/2 concurrent requests are multiplexed over a single connection
+        self.http_client = httpx.AsyncClient(
+            http2=HTTP2_AVAILABLE,
+            timeout=httpx.Timeout(60.0),
+            limits=httpx.Limits(max_connections=32, max_keepalive_connections=32, keepalive_expiry=60.0)
+        )
+        
         # Initialize the language model
         self.llm = ChatOpenAI(
             temperature=0.3,
             model_name="gpt-4o-mini",
-            openai_api_key=self.api_key
+            openai_api_key=self.api_key,
+            http_async_client=self.http_client
         )
         
-        # Initialize output parser
-        self.output_parser = StrOutputParser()
-        
-        # Initialize prompt templates
-        self.translation_prompt = ChatPromptTemplate.from_template(
-            "Translate the following text from {source_lang} to {target_lang} conceptually. "
-            "\n\n{text}"
-        )
+        # In-process LRU translation cache, keyed by _cache_key
+        self.translation_cache: "OrderedDict[str, str]" = OrderedDict()
         
-        self.summarization_prompt = ChatPromptTemplate.from_template(
-            "Summarize the following text in about {max_length} characters. "
-            "Focus on the main points and key information:\n\n{text}"
-        )
+        # Limit how many LLM requests run at once when fanning out
+        self._sem = asyncio.Semaphore(8)
         
-        self.language_detection_prompt = ChatPromptTemplate.from_template(
-            "Identify the language of the following text and respond with just the ISO 639-1 language code "
-            "(e.g., 'en' for English):\n\n{text}"
-        )
+        # Initialize output parser
+        self.output_parser = StrOutputParser()
         
-        self.news_digest_prompt = ChatPromptTemplate.from_template(
-            "Create a brief news digest in {target_lang} based on these news items:\n\n{news_text}\n\n"
-            "Format the digest as a concise summary of the main developments."
-        )
+        # Prompt templates are parsed once per process (see module level)
+        self.translation_prompt = TRANSLATION_PROMPT
+        self.summarization_prompt = SUMMARIZATION_PROMPT
+        self.news_digest_prompt = NEWS_DIGEST_PROMPT
         
-        # Initialize chains using RunnablePassthrough
+        # Initialize chains (prompt | llm | parser)
         self.translation_chain = (
             self.translation_prompt 
             | self.llm 
@@ -77,12 +116,6 @@ class LLMManager:
             | self.output_parser
         )
         
-        self.language_detection_chain = (
-            self.language_detection_prompt 
-            | self.llm 
-            | self.output_parser
-        )
-        
         self.news_digest_chain = (
             self.news_digest_prompt 
             | self.llm 
@@ -93,6 +126,11 @@ class LLMManager:
         """Translate text from source language to target language using LangChain."""
         if source_lang == target_lang:
             return text
+        
+        cache_key = self._cache_key(source_lang, target_lang, text)
+        if cache_key in self.translation_cache:
+            self.translation_cache.move_to_end(cache_key)
+            return self.translation_cache[cache_key]
             
         try:
             with get_openai_callback() as cb:
@@ -102,11 +140,30 @@ class LLMManager:
                     "text": text
                 })
                 self.logger.info(f"Translation cost: {cb.total_cost}")
-                return result.strip()
+                translated = result.strip()
+                self.translation_cache[cache_key] = translated
+                if len(self.translation_cache) > TRANSLATION_CACHE_SIZE:
+                    self.translation_cache.popitem(last=False)
+                return translated
         except Exception as e:
             self.logger.error(f"Translation error: {e}")
             return text
     
+    @staticmethod
+    def _cache_key(source_lang: str, target_lang: str, text: str) -> str:
+        """Build a deterministic cache key; whitespace-only variants of a text share a key."""
+        normalized = " ".join(text.split())
+        digest = hashlib.blake2b(normalized.encode('utf-8'), digest_size=16).hexdigest()
+        return f"{source_lang}:{target_lang}:{digest}"
+    
+    async def translate_many(self, texts: List[str], source_lang: str, target_lang: str) -> List[str]:
+        """Translate several texts concurrently, preserving their order."""
+        async def translate_one(text: str) -> str:
+            async with self._sem:
+                return await self.translate_text(text, source_lang, target_lang)
+        
+        return await asyncio.gather(*(translate_one(text) for text in texts))
+    
     async def summarize_text(self, text: str, max_length: int = 200) -> str:
         """Generate a concise summary of the text using LangChain."""
         try:
@@ -122,10 +179,11 @@ class LLMManager:
             return text[:max_length] + "..."
     
     async def detect_language(self, text: str) -> str:
-        """Detect the language of a text using LangChain."""
+        """Detect the language of a text with a direct call to the language model."""
         try:
             with get_openai_callback() as cb:
-                result = await self.language_detection_chain.ainvoke({"text": text})
+                message = await self.llm.ainvoke(LANGUAGE_DETECTION_PROMPT.format(text=text))
+                result = message.content
                 self.logger.info(f"Language detection cost: {cb.total_cost}")
                 
                 # Clean and validate the response
@@ -140,15 +198,9 @@ class LLMManager:
     async def generate_news_digest(self, news_items: List[Dict], target_lang: str) -> str:
         """Generate a digest of multiple news items using LangChain."""
         try:
-            # Create a formatted list of news items
-            news_text = ""
-            for i, item in enumerate(news_items, 1):
-                news_text += f"{i}. {item['title']}\n"
-                news_text += f"{item['description'][:150]}...\n\n"
-            
             with get_openai_callback() as cb:
                 result = await self.news_digest_chain.ainvoke({
-                    "news_text": news_text,
+                    "news_text": self._format_news_items(news_items),
                     "target_lang": target_lang
                 })
                 self.logger.info(f"News digest cost: {cb.total_cost}")
@@ -157,10 +209,22 @@ class LLMManager:
             self.logger.error(f"News digest error: {e}")
             return "Failed to generate news digest."
     
+    @staticmethod
+    def _format_news_items(news_items: List[Dict]) -> str:
+        """Create a formatted list of news items for the digest prompt."""
+        return "".join(
+            f"{i}. {item['title']}\n{(item['description'] or '')[:150]}...\n\n"
+            for i, item in enumerate(news_items, 1)
+        )
+    
     def get_usage_stats(self) -> Dict:
         """Get usage statistics for the LLM operations."""
         return {
             "model": self.llm.model_name,
             "temperature": self.llm.temperature,
-            "cache_enabled": isinstance(langchain.llm_cache, InMemoryCache)
-        }
\ No newline at end of file
+            "cache_enabled": isinstance(langchain.llm_cache, SQLiteCache)
+        }
+    
+    async def close(self):
+        """Close the shared HTTP client."""
+        await self.http_client.aclose()
@@ -1,16 +1,142 @@
+import asyncio
+import hashlib
+import itertools
 import logging
+import re
+import threading
 import feedparser
+import requests
 import sqlite3
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 from datetime import datetime, timedelta
 import os
-from dotenv import load_dotenv
 from bs4 import BeautifulSoup
-import langdetect
+from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
 from edge_tts_lib import EdgeTTS
 
 # Load environment variables
 load_dotenv()
 
+# Number of feeds downloaded in parallel by check_feeds
+FEED_FETCH_WORKERS = int(os.getenv('FEED_FETCH_WORKERS', '8'))
+
+# Seconds to wait for a feed server before giving up on that feed
+FEED_FETCH_TIMEOUT = 10
+
+# Worker processes used to parse downloaded feeds; 0 parses in the download threads.
+# Parsing is pure Python and holds the GIL, so processes help when many large feeds are polled.
+FEED_PARSE_PROCESSES = int(os.getenv('FEED_PARSE_PROCESSES', '0'))
+
+# Days a stored news item is kept before prune_old_news deletes it
+NEWS_RETENTION_DAYS = int(os.getenv('NEWS_RETENTION_DAYS', '30'))
+
+# Days prune_old_news remembers a pruned link, so a feed still carrying it doesn't store it again
+PRUNED_LINK_RETENTION_DAYS = int(os.getenv('PRUNED_LINK_RETENTION_DAYS', '90'))
+
+# News items deleted per transaction by prune_old_news, so writers aren't blocked for long
+_NEWS_PRUNE_CHUNK = 1000
+
+# Bump whenever schema.sql or _migrate_db changes so existing databases pick it up
+# (tracked in its own schema_meta table; PRAGMA user_version belongs to database.Database)
+SCHEMA_VERSION = 6
+
+# Database schema, read once at import from next to this module (not from the working directory)
+with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'schema.sql'), 'r') as f:
+    _SCHEMA_SQL = f.read()
+
+# Patterns used by _extract_feed_name
+_RE_PROTOCOL = re.compile(r'^https?://')
+_RE_WWW = re.compile(r'^www\.')
+_RE_PATH = re.compile(r'/.*$')
+
+# Map of language codes to EdgeTTS voices
+# https://gist.github.com/BettyJJ/17cbaa1de96235a7f5773b8690a20462
+_VOICE_MAP = {
+    'en': 'en-US-AriaNeural',  # English
+    'es': 'es-ES-AlvaroNeural',  # Spanish
+    'fr': 'fr-FR-DeniseNeural',  # French
+    'de': 'de-DE-KatjaNeural',  # German
+    'it': 'it-IT-ElsaNeural',  # Italian
+    'pt': 'pt-BR-FranciscaNeural',  # Portuguese
+    'ru': 'ru-RU-SvetlanaNeural',  # Russian
+    'zh': 'zh-CN-XiaoxiaoNeural',  # Chinese
+    'ja': 'ja-JP-NanamiNeural',  # Japanese
+    'ar': 'ar-SA-ZariyahNeural',  # Arabic
+    'fa': 'fa-IR-FaridNeural',  # Persian
+}
+
+# Hot-path SQL, kept as constants so the connection's statement cache is always hit
+_SQL_GET_USER_BY_USERNAME = "SELECT user_id FROM users WHERE username = ?"
+_SQL_GET_USER_BY_EMAIL = "SELECT user_id FROM users WHERE email = ?"
+_SQL_INSERT_USER = "INSERT INTO users (username, email) VALUES (?, ?)"
+_SQL_INIT_USER_SCHEDULE = (
+    "INSERT OR IGNORE INTO user_schedule (user_id, enabled, interval_minutes) VALUES (?, ?, ?)"
+)
+_SQL_INIT_USER_PREFERENCES = (
+    "INSERT OR IGNORE INTO user_preferences (user_id, preferred_language, enable_translation, max_news_items) "
+    "VALUES (?, ?, ?, ?)"
+)
+_SQL_GET_USER_LANGUAGE = "SELECT preferred_language FROM user_preferences WHERE user_id = ?"
+_SQL_GET_USER_PREFERENCES = (
+    "SELECT preferred_language, enable_translation, max_news_items, enable_voice, voice_language "
+    "FROM user_preferences WHERE user_id = ?"
+)
+# News rows are inserted with multi-row VALUES lists of up to _NEWS_INSERT_CHUNK rows;
+# 100 rows x 5 columns stays under SQLite's default limit of 999 bound parameters
+_NEWS_INSERT_CHUNK = 100
+_SQL_INSERT_NEWS_PREFIX = (
+    "INSERT OR IGNORE INTO news_items (feed_id, title, link, description, pub_date) VALUES "
+)
+_SQL_UPDATE_FEED_TIMESTAMP = (
+    "UPDATE rss_feeds SET last_updated = CURRENT_TIMESTAMP, etag = ?, modified = ?, "
+    "language = COALESCE(?, language) WHERE feed_id = ?"
+)
+# Links looked up per query when skipping already stored items (SQLite caps bound parameters)
+_LINK_LOOKUP_CHUNK = 500
+_SQL_MARK_DELIVERED = "INSERT OR IGNORE INTO news_delivery (user_id, news_id) VALUES (?, ?)"
+_SQL_UPDATE_LAST_DELIVERY = "UPDATE user_schedule SET last_delivery = CURRENT_TIMESTAMP WHERE user_id = ?"
+_SQL_GET_FEEDS_TO_CHECK = "SELECT feed_id, feed_url, etag, modified FROM rss_feeds"
+_SQL_GET_UNDELIVERED_NEWS = """
+    SELECT ni.news_id, ni.title, ni.link, ni.description, ni.pub_date, rf.feed_name,
+           rf.language AS feed_language
+    FROM user_feeds uf
+    JOIN news_items ni ON ni.feed_id = uf.feed_id
+    JOIN rss_feeds rf ON rf.feed_id = uf.feed_id
+    WHERE uf.user_id = :user_id AND NOT EXISTS (
+        SELECT 1 FROM news_delivery nd
+        WHERE nd.news_id = ni.news_id AND nd.user_id = :user_id
+    )
+    AND (:before_pub_date IS NULL OR (ni.pub_date, ni.news_id) < (:before_pub_date, :before_news_id))
+    ORDER BY ni.pub_date DESC, ni.news_id DESC
+    LIMIT COALESCE(
+        (SELECT max_news_items FROM user_preferences WHERE user_id = :user_id),
+        5
+    )
+"""
+
+def _parse_feed_content(content: bytes, response_headers: dict):
+    """Parse downloaded feed bytes. Module level so it can be sent to a worker process."""
+    # Skip the relative-URI rewriting and HTML sanitizing passes over every entry;
+    # descriptions are only ever sent on as plain message text
+    parsed = feedparser.parse(
+        content,
+        response_headers=response_headers,
+        resolve_relative_uris=False,
+        sanitize_html=False
+    )
+    # Malformed feeds carry a SAXParseException, which can't be pickled back from a worker
+    # process; keep only its message
+    if 'bozo_exception' in parsed:
+        parsed['bozo_exception'] = str(parsed['bozo_exception'])
+    return parsed
+
+def _strip_html(text: str) -> str:
+    """Return the plain text of an HTML fragment; text without markup is returned as is."""
+    if '<' not in text:
+        return text
+    return BeautifulSoup(text, 'html.parser').get_text(' ', strip=True)
+
 class NewsManager:
     def __init__(self, db_path: str = "news_database.db"):
         """Initialize the News Manager."""
@@ -22,12 +148,27 @@ class NewsManager:
         self.logger = logging.getLogger(__name__)
         self.logger.info("Initializing News Manager")
         
-        # Initialize database
+        # Initialize database; each thread gets its own connection (see the conn property)
         self.db_path = db_path
-        self.conn = sqlite3.connect(self.db_path)
-        self.cursor = self.conn.cursor()
+        self._local = threading.local()
+        self._connections = []
+        self._connections_lock = threading.Lock()
         self._init_db()
         
+        # Cache of Telegram user ID -> database user ID (see _get_db_user_id)
+        self._uid_cache = {}
+        
+        # Shared HTTP session so feed downloads reuse pooled keep-alive connections
+        # (gzip is negotiated by requests automatically)
+        self._http = requests.Session()
+        adapter = HTTPAdapter(pool_connections=16, pool_maxsize=max(16, FEED_FETCH_WORKERS))
+        self._http.mount('http://', adapter)
+        self._http.mount('https://', adapter)
+        
+        # Long-lived pool of download threads shared by every check_feeds call
+        self._fetch_pool = ThreadPoolExecutor(max_workers=FEED_FETCH_WORKERS, thread_name_prefix='feed-fetch')
+        self._parse_pool = ProcessPoolExecutor(max_workers=FEED_PARSE_PROCESSES) if FEED_PARSE_PROCESSES > 0 else None
+        
         # Create voice files directory if it doesn't exist
         self.voice_dir = "voice_files"
         if not os.path.exists(self.voice_dir):
@@ -36,18 +177,87 @@ class NewsManager:
         # Initialize EdgeTTS
         self.tts = EdgeTTS()
         
+        # content_hash -> synthesis in progress, so concurrent deliveries of the same
+        # text share one synthesis instead of writing the same file at once
+        self._voice_tasks = {}
+        
+    @property
+    def conn(self) -> sqlite3.Connection:
+        """SQLite connection owned by the calling thread, opened on first use."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            # check_same_thread=False only so close() can close it from another thread;
+            # the connection itself is never shared between threads
+            conn = sqlite3.connect(self.db_path, check_same_thread=False, cached_statements=256)
+            self._configure_connection(conn)
+            # Rows support both index and column-name access without building a dict per row
+            conn.row_factory = sqlite3.Row
+            self._local.conn = conn
+            self._local.cursor = conn.cursor()
+            with self._connections_lock:
+                self._connections.append(conn)
+        return conn
+    
+    @property
+    def cursor(self) -> sqlite3.Cursor:
+        """Cursor on the calling thread's connection."""
+        self.conn  # opens this thread's connection (and cursor) if needed
+        return self._local.cursor
+        
+    def _configure_connection(self, conn: sqlite3.Connection):
+        """Apply WAL journaling and performance PRAGMAs to a connection."""
+        conn.executescript(
+            "PRAGMA journal_mode=WAL; "
+            "PRAGMA synchronous=NORMAL; "
+            "PRAGMA temp_store=MEMORY; "
+            "PRAGMA cache_size=-65536; "
+            "PRAGMA mmap_size=268435456; "
+            "PRAGMA foreign_keys=ON;"
+        )
+        
     def _init_db(self):
         """Initialize the SQLite database."""
         try:
-            with open('schema.sql', 'r') as f:
-                schema = f.read()
-            self.cursor.executescript(schema)
-            self.conn.commit()
+            # Skip the schema script once this database is already at the current version
+            self.cursor.execute("CREATE TABLE IF NOT EXISTS schema_meta (version INTEGER NOT NULL)")
+            self.cursor.execute("SELECT MAX(version) FROM schema_meta")
+            version = self.cursor.fetchone()[0]
+            if version is None or version < SCHEMA_VERSION:
+                self.cursor.executescript(_SCHEMA_SQL)
+                with self.conn:
+                    self._migrate_db()
+                    self.cursor.execute("DELETE FROM schema_meta")
+                    self.cursor.execute("INSERT INTO schema_meta (version) VALUES (?)", (SCHEMA_VERSION,))
             self.logger.info("Database initialized successfully")
         except Exception as e:
             self.logger.error(f"Error initializing database: {str(e)}")
             raise
         
+    def _migrate_db(self):
+        """Add columns introduced after a database was first created."""
+        self.cursor.execute("PRAGMA table_info(rss_feeds)")
+        feed_columns = {row[1] for row in self.cursor.fetchall()}
+        for column in ('etag', 'modified', 'language'):
+            if column not in feed_columns:
+                self.cursor.execute(f"ALTER TABLE rss_feeds ADD COLUMN {column} TEXT")
+        
+        self.cursor.execute("PRAGMA table_info(voice_files)")
+        voice_columns = {row[1] for row in self.cursor.fetchall()}
+        if 'content_hash' not in voice_columns:
+            self.cursor.execute("ALTER TABLE voice_files ADD COLUMN content_hash TEXT")
+        # Created here rather than in schema.sql, which runs before the column exists on old databases
+        self.cursor.execute("CREATE INDEX IF NOT EXISTS idx_voice_hash ON voice_files(content_hash)")
+        # get_voice_file looks files up by content_hash, so the (news_id, language) index is
+        # replaced by idx_voice_news (schema.sql) for the news_id lookups
+        self.cursor.execute("DROP INDEX IF EXISTS idx_voice_news_lang")
+        
+        self.cursor.execute("PRAGMA table_info(pruned_links)")
+        pruned_columns = {row[1] for row in self.cursor.fetchall()}
+        if 'pruned_at' not in pruned_columns:
+            # ALTER TABLE can't add a CURRENT_TIMESTAMP default; prune_old_news sets it explicitly
+            self.cursor.execute("ALTER TABLE pruned_links ADD COLUMN pruned_at TIMESTAMP")
+            self.cursor.execute("UPDATE pruned_links SET pruned_at = CURRENT_TIMESTAMP")
+        
     def add_user(self, user_id: str, username: str, email: str = None):
         """Add a new user to the database."""
         try:
@@ -59,54 +269,58 @@ class NewsManager:
             if not email:
                 email = f"{user_id}@telegram.user"
             
-            # First check if user already exists
-            self.cursor.execute("SELECT user_id FROM users WHERE username = ?", (username,))
-            existing_user = self.cursor.fetchone()
-            
-            if existing_user:
-                db_user_id = existing_user[0]
-                self.logger.info(f"User {username} already exists with ID {db_user_id}")
-            else:
-                # Add new user
+            # The user row and its default settings are committed together
+            with self.conn:
+                # Take the write lock before the existence check so it can't race another insert
+                self.conn.execute("BEGIN IMMEDIATE")
+                
+                # First check if user already exists
+                self.cursor.execute(_SQL_GET_USER_BY_USERNAME, (username,))
+                existing_user = self.cursor.fetchone()
+                
+                if existing_user:
+                    db_user_id = existing_user[0]
+                    self.logger.info(f"User {username} already exists with ID {db_user_id}")
+                else:
+                    # Add new user
+                    self.cursor.execute(_SQL_INSERT_USER, (username, email))
+                    db_user_id = self.cursor.lastrowid
+                    self.logger.info(f"User {username} added successfully with ID {db_user_id}")
+                
+                # Initialize user settings in user_schedule table if not exists
                 self.cursor.execute(
-                    "INSERT INTO users (username, email) VALUES (?, ?)",
-                    (username, email)
+                    _SQL_INIT_USER_SCHEDULE,
+                    (db_user_id, False, 60)  # Default: disabled, hourly
+                )
+                
+                # Initialize user preferences if not exists
+                self.cursor.execute(
+                    _SQL_INIT_USER_PREFERENCES,
+                    (db_user_id, 'en', True, 5)  # Default: English, translation enabled, 5 items
                 )
-                self.conn.commit()
-                db_user_id = self.cursor.lastrowid
-                self.logger.info(f"User {username} added successfully with ID {db_user_id}")
-            
-            # Initialize user settings in user_schedule table if not exists
-            self.cursor.execute(
-                "INSERT OR IGNORE INTO user_schedule (user_id, enabled, interval_minutes) VALUES (?, ?, ?)",
-                (db_user_id, False, 60)  # Default: disabled, hourly
-            )
-            
-            # Initialize user preferences if not exists
-            self.cursor.execute(
-                "INSERT OR IGNORE INTO user_preferences (user_id, preferred_language, enable_translation, max_news_items) VALUES (?, ?, ?, ?)",
-                (db_user_id, 'en', True, 5)  # Default: English, translation enabled, 5 items
-            )
             
-            self.conn.commit()
+            # Remember the mapping so the first lookup after registration skips the SELECTs.
+            # Only for the user_<id> username that _lookup_db_user_id resolves first: any other
+            # username may belong to a different Telegram user's row
+            if username == f"user_{user_id}":
+                self._uid_cache[str(user_id)] = db_user_id
             return db_user_id
         except Exception as e:
             self.logger.error(f"Error adding user: {str(e)}")
-            self.conn.rollback()
             raise
             
     def add_feed(self, feed_url: str, feed_name: str = None) -> int:
         """Add a new RSS feed to the database."""
         try:
             # Verify feed URL
-            feed = feedparser.parse(feed_url)
+            feed = self._parse_feed_remote(feed_url)
             if not feed.entries:
                 self.logger.warning(f"Invalid or empty RSS feed: {feed_url}")
                 return 0
             
             # Extract feed name from feed if not provided
             if not feed_name:
-                feed_name = feed.feed.title if hasattr(feed.feed, 'title') else self._extract_feed_name(feed_url)
+                feed_name = feed.feed.get('title') or self._extract_feed_name(feed_url)
             
             # Check if feed already exists
             self.cursor.execute("SELECT feed_id FROM rss_feeds WHERE feed_url = ?", (feed_url,))
@@ -116,23 +330,22 @@ class NewsManager:
                 self.logger.info(f"Feed already exists: {feed_url}")
                 return existing[0]  # Return existing feed_id
             
-            # Add the feed
-            self.cursor.execute(
-                "INSERT INTO rss_feeds (feed_url, feed_name) VALUES (?, ?)",
-                (feed_url, feed_name)
-            )
-            self.conn.commit()
+            # Add the feed and its initial items in one transaction, so a failure
+            # leaves neither behind
+            with self.conn:
+                self.cursor.execute(
+                    "INSERT INTO rss_feeds (feed_url, feed_name) VALUES (?, ?)",
+                    (feed_url, feed_name)
+                )
+                feed_id = self.cursor.lastrowid
+                
+                # Store initial items from the feed we already downloaded for validation
+                self._fetch_feed_items(feed_id, feed_url, parsed=feed)
             
-            feed_id = self.cursor.lastrowid
             self.logger.info(f"Feed {feed_name} added successfully with ID {feed_id}")
-            
-            # Fetch initial items
-            self._fetch_feed_items(feed_id, feed_url)
-            
             return feed_id
         except Exception as e:
             self.logger.error(f"Error adding feed: {str(e)}")
-            self.conn.rollback()
             return 0
             
     def subscribe_user_to_feed(self, user_id: str, feed_id: int):
@@ -144,26 +357,19 @@ class NewsManager:
                 self.logger.error(f"User {user_id} not found in database")
                 return False
             
-            # Check if already subscribed
-            self.cursor.execute(
-                "SELECT * FROM user_feeds WHERE user_id = ? AND feed_id = ?",
-                (db_user_id, feed_id)
-            )
-            if self.cursor.fetchone():
+            # Subscribe user; the (user_id, feed_id) primary key turns a repeat into a no-op
+            with self.conn:
+                self.cursor.execute(
+                    "INSERT OR IGNORE INTO user_feeds (user_id, feed_id) VALUES (?, ?)",
+                    (db_user_id, feed_id)
+                )
+            if self.cursor.rowcount == 0:
                 self.logger.info(f"User {user_id} already subscribed to feed {feed_id}")
-                return True
-            
-            # Subscribe user
-            self.cursor.execute(
-                "INSERT INTO user_feeds (user_id, feed_id) VALUES (?, ?)",
-                (db_user_id, feed_id)
-            )
-            self.conn.commit()
-            self.logger.info(f"User {user_id} subscribed to feed {feed_id}")
+            else:
+                self.logger.info(f"User {user_id} subscribed to feed {feed_id}")
             return True
         except Exception as e:
             self.logger.error(f"Error subscribing user to feed: {str(e)}")
-            self.conn.rollback()
             return False
             
     def unsubscribe_user_from_feed(self, user_id: str, feed_id: int):
@@ -174,16 +380,15 @@ class NewsManager:
             if not db_user_id:
                 return False
             
-            self.cursor.execute(
-                "DELETE FROM user_feeds WHERE user_id = ? AND feed_id = ?",
-                (db_user_id, feed_id)
-            )
-            self.conn.commit()
+            with self.conn:
+                self.cursor.execute(
+                    "DELETE FROM user_feeds WHERE user_id = ? AND feed_id = ?",
+                    (db_user_id, feed_id)
+                )
             self.logger.info(f"User {user_id} unsubscribed from feed {feed_id}")
             return True
         except Exception as e:
             self.logger.error(f"Error unsubscribing user: {str(e)}")
-            self.conn.rollback()
             return False
             
     def get_user_feeds(self, user_id: str):
@@ -201,8 +406,7 @@ class NewsManager:
                 WHERE uf.user_id = ?
             """, (db_user_id,))
             
-            columns = [description[0] for description in self.cursor.description]
-            return [dict(zip(columns, row)) for row in self.cursor.fetchall()]
+            return self.cursor.fetchall()
         except Exception as e:
             self.logger.error(f"Error getting user feeds: {str(e)}")
             return []
@@ -210,127 +414,261 @@ class NewsManager:
     def check_feeds(self):
         """Check all feeds for new content."""
         try:
-            self.cursor.execute("SELECT feed_id, feed_url FROM rss_feeds")
+            self.cursor.execute(_SQL_GET_FEEDS_TO_CHECK)
             feeds = self.cursor.fetchall()
             
+            # Download feeds in parallel; the database writes stay on this thread
+            fetched = []
+            futures = {
+                self._fetch_pool.submit(self._parse_feed_remote, feed_url, etag, modified): feed_id
+                for feed_id, feed_url, etag, modified in feeds
+            }
+            for future in as_completed(futures):
+                feed_id = futures[future]
+                try:
+                    feed = future.result()
+                except Exception as e:
+                    self.logger.error(f"Error fetching feed {feed_id}: {str(e)}")
+                    continue
+                if feed.get('status') != 304:
+                    fetched.append((feed_id, feed))
+            
+            # Build every feed's rows before taking the write lock: the link lookups are
+            # plain WAL reads and the HTML stripping is slow, so only the INSERTs and
+            # UPDATEs below hold the lock
+            prepared = []
+            for feed_id, feed in fetched:
+                try:
+                    prepared.append((feed_id, feed, self._build_feed_rows(feed_id, feed)))
+                except Exception as e:
+                    self.logger.error(f"Error preparing items of feed {feed_id}: {str(e)}")
+            
+            # Store every changed feed in one transaction, so the whole pass costs a single commit
             total_added = 0
-            for feed_id, feed_url in feeds:
-                added = self._fetch_feed_items(feed_id, feed_url)
-                total_added += added
+            if prepared:
+                with self.conn:
+                    self.conn.execute("BEGIN IMMEDIATE")
+                    for feed_id, feed, rows in prepared:
+                        total_added += self._store_feed_items(feed_id, feed, rows)
                 
             self.logger.info(f"Checked {len(feeds)} feeds, added {total_added} new items")
             return total_added
         except Exception as e:
             self.logger.error(f"Error checking feeds: {str(e)}")
             return 0
+    
+    async def check_feeds_async(self):
+        """Check all feeds for new content without blocking the event loop."""
+        return await asyncio.to_thread(self.check_feeds)
             
-    def _fetch_feed_items(self, feed_id: int, feed_url: str) -> int:
-        """Fetch and store items from a feed."""
+    def _fetch_feed_items(self, feed_id: int, feed_url: str, parsed=None) -> int:
+        """Fetch and insert items from a feed as part of the caller's transaction.
+        
+        Pass an already parsed feed as `parsed` to skip downloading it again.
+        """
+        feed = parsed
+        if feed is None:
+            try:
+                feed = self._parse_feed_remote(feed_url)
+            except Exception as e:
+                self.logger.error(f"Error fetching feed items: {str(e)}")
+                return 0
+        return self._insert_feed_items(feed_id, feed)
+    
+    def _parse_feed_remote(self, feed_url: str, etag: str = None, modified: str = None):
+        """Download and parse a feed. Does no database access, so it is safe to run in a worker thread.
+        
+        The stored ETag / Last-Modified values make the request conditional, so an
+        unchanged feed comes back as a 304 with no entries to parse.
+        """
+        headers = {}
+        if etag:
+            headers['If-None-Match'] = etag
+        if modified:
+            headers['If-Modified-Since'] = modified
+        
+        response = self._http.get(feed_url, headers=headers, timeout=FEED_FETCH_TIMEOUT)
+        if response.status_code == 304:
+            return feedparser.FeedParserDict(status=304, entries=[], feed=feedparser.FeedParserDict())
+        # Don't parse an error page or let it overwrite the stored ETag / Last-Modified
+        response.raise_for_status()
+        
+        # feedparser looks response headers up by lower-case name
+        response_headers = {name.lower(): value for name, value in response.headers.items()}
+        if self._parse_pool is not None:
+            feed = self._parse_pool.submit(_parse_feed_content, response.content, response_headers).result()
+        else:
+            feed = _parse_feed_content(response.content, response_headers)
+        feed['status'] = response.status_code
+        feed['etag'] = response.headers.get('ETag')
+        feed['modified'] = response.headers.get('Last-Modified')
+        return feed
+            
+    def _store_feed_items(self, feed_id: int, feed, rows: list) -> int:
+        """Store a parsed feed's rows (from _build_feed_rows) inside the caller's transaction.
+        
+        The feed gets its own savepoint, so a failure only undoes this feed's rows.
+        """
+        if feed.get('status') == 304:
+            # Feed unchanged since the last fetch
+            return 0
+        
+        self.conn.execute("SAVEPOINT store_feed")
         try:
-            feed = feedparser.parse(feed_url)
-            added_count = 0
-            
-            for entry in feed.entries:
-                # Extract entry data
-                title = entry.title if hasattr(entry, 'title') else "No title"
-                link = entry.link if hasattr(entry, 'link') else ""
-                
-                # Extract description (handle different formats)
-                if hasattr(entry, 'description'):
-                    description = entry.description
-                elif hasattr(entry, 'summary'):
-                    description = entry.summary
-                elif hasattr(entry, 'content'):
-                    description = entry.content[0].value
-                else:
-                    description = "No description available"
-                
-                # Parse publication date
-                if hasattr(entry, 'published_parsed') and entry.published_parsed:
-                    pub_date = datetime(*entry.published_parsed[:6])
-                elif hasattr(entry, 'updated_parsed') and entry.updated_parsed:
-                    pub_date = datetime(*entry.updated_parsed[:6])
-                else:
-                    pub_date = datetime.now()
-                
-                # Check if item already exists (by link)
-                self.cursor.execute("SELECT news_id FROM news_items WHERE link = ?", (link,))
-                if self.cursor.fetchone():
-                    continue
-                
-                # Add news item
-                self.cursor.execute(
-                    """INSERT INTO news_items 
-                       (feed_id, title, link, description, pub_date) 
-                       VALUES (?, ?, ?, ?, ?)""",
-                    (feed_id, title, link, description, pub_date)
-                )
-                added_count += 1
-            
-            # Update last_updated timestamp
-            self.cursor.execute(
-                "UPDATE rss_feeds SET last_updated = CURRENT_TIMESTAMP WHERE feed_id = ?",
-                (feed_id,)
-            )
-            self.conn.commit()
-            
-            if added_count > 0:
-                self.logger.info(f"Added {added_count} new items from feed {feed_id}")
-            
-            return added_count
+            added_count = self._write_feed_rows(feed_id, feed, rows)
         except Exception as e:
-            self.logger.error(f"Error fetching feed items: {str(e)}")
-            self.conn.rollback()
+            self.logger.error(f"Error storing feed items: {str(e)}")
+            self.conn.execute("ROLLBACK TO store_feed")
+            added_count = 0
+        self.conn.execute("RELEASE store_feed")
+        return added_count
+    
+    def _insert_feed_items(self, feed_id: int, feed) -> int:
+        """Insert the entries of a parsed feed and update its last_updated; the caller commits."""
+        if feed.get('status') == 304:
+            # Feed unchanged since the last fetch
             return 0
-            
-    def get_undelivered_news(self, user_id: str):
-        """Get all undelivered news items for a user."""
+        return self._write_feed_rows(feed_id, feed, self._build_feed_rows(feed_id, feed))
+    
+    def _build_feed_rows(self, feed_id: int, feed) -> list:
+        """Build news_items rows for the entries of a parsed feed that aren't stored yet. Only reads the database."""
+        rows = []
+        
+        # Most entries of a polled feed were seen before; skip them without building rows
+        # (dict.fromkeys drops links repeated within the feed while keeping their order)
+        links = list(dict.fromkeys(entry.get('link', "") for entry in feed.entries))
+        existing = self._existing_links(links)
+        
+        for entry in feed.entries:
+            # Extract entry data (FeedParserDict.get is a plain dict lookup, unlike hasattr)
+            link = entry.get('link', "")
+            if link in existing:
+                continue
+            title = entry.get('title', "No title")
+            
+            # Extract description (handle different formats)
+            description = entry.get('description') or entry.get('summary')
+            if description is None:
+                content = entry.get('content')
+                description = content[0].get('value') if content else "No description available"
+            # Store plain text once so delivery, translation and TTS never re-parse the HTML
+            description = _strip_html(description)
+            
+            # Parse publication date
+            parsed_date = entry.get('published_parsed') or entry.get('updated_parsed')
+            pub_date = datetime(*parsed_date[:6]) if parsed_date else datetime.now()
+            
+            rows.append((feed_id, title, link, description, pub_date))
+            # Later entries with the same link are duplicates of this one
+            existing.add(link)
+        
+        return rows
+    
+    def _write_feed_rows(self, feed_id: int, feed, rows: list) -> int:
+        """Insert rows built by _build_feed_rows and update the feed's last_updated; the caller commits."""
+        cursor = self.conn.cursor()
+        
+        # INSERT OR IGNORE keeps the insert safe against a concurrent writer storing the same link
+        # One statement per chunk is cheaper than executemany's statement step per row
+        added_count = 0
+        for start in range(0, len(rows), _NEWS_INSERT_CHUNK):
+            chunk = rows[start:start + _NEWS_INSERT_CHUNK]
+            values = ", ".join(["(?, ?, ?, ?, ?)"] * len(chunk))
+            cursor.execute(_SQL_INSERT_NEWS_PREFIX + values, list(itertools.chain.from_iterable(chunk)))
+            added_count += cursor.rowcount
+        cursor.execute(
+            _SQL_UPDATE_FEED_TIMESTAMP,
+            (feed.get('etag'), feed.get('modified'), self._feed_language(feed), feed_id)
+        )
+        
+        if added_count > 0:
+            self.logger.info(f"Added {added_count} new items from feed {feed_id}")
+        
+        return added_count
+    
+    def _feed_language(self, feed):
+        """Return the feed's declared language as a two-letter code (e.g. 'en' for 'en-US'), or None."""
+        language = feed.get('feed', {}).get('language')
+        if not language:
+            return None
+        return language.split('-')[0].strip().lower() or None
+    
+    def _existing_links(self, links: list) -> set:
+        """Return the subset of links that are already stored in news_items or were pruned from it."""
+        existing = set()
+        for start in range(0, len(links), _LINK_LOOKUP_CHUNK):
+            chunk = links[start:start + _LINK_LOOKUP_CHUNK]
+            placeholders = ','.join('?' * len(chunk))
+            for table in ('news_items', 'pruned_links'):
+                rows = self.conn.execute(f"SELECT link FROM {table} WHERE link IN ({placeholders})", chunk)
+                existing.update(row[0] for row in rows)
+        return existing
+            
+    def get_undelivered_news(self, user_id: str, before_pub_date=None, before_news_id=None):
+        """Get undelivered news items for a user, newest first.
+        
+        Pass the pub_date and news_id of the last item of the previous batch as before_pub_date
+        and before_news_id to continue from there (pub_date alone isn't unique).
+        """
         try:
             # Convert telegram user_id to database user_id
             db_user_id = self._get_db_user_id(user_id)
             if not db_user_id:
                 return []
             
-            # Get user preferences
-            preferences = self.get_user_preferences(user_id)
-            max_items = preferences.get('max_news_items', 5)
+            # The user's max_news_items is read inside the query instead of through
+            # get_user_preferences, saving a round trip per delivery
+            self.cursor.execute(
+                _SQL_GET_UNDELIVERED_NEWS,
+                {'user_id': db_user_id, 'before_pub_date': before_pub_date, 'before_news_id': before_news_id}
+            )
             
-            self.cursor.execute("""
-                SELECT ni.news_id, ni.title, ni.link, ni.description, ni.pub_date, rf.feed_name
-                FROM news_items ni
-                JOIN rss_feeds rf ON ni.feed_id = rf.feed_id
-                JOIN user_feeds uf ON rf.feed_id = uf.feed_id
-                LEFT JOIN news_delivery nd ON ni.news_id = nd.news_id AND nd.user_id = ?
-                WHERE uf.user_id = ? AND nd.delivery_id IS NULL
-                ORDER BY ni.pub_date DESC
-                LIMIT ?
-            """, (db_user_id, db_user_id, max_items))
-            
-            columns = [description[0] for description in self.cursor.description]
-            return [dict(zip(columns, row)) for row in self.cursor.fetchall()]
+            return self.cursor.fetchall()
         except Exception as e:
             self.logger.error(f"Error getting undelivered news: {str(e)}")
             return []
             
     def mark_news_delivered(self, user_id: str, news_id: int):
         """Mark a news item as delivered to a user."""
+        return self.mark_news_delivered_bulk(user_id, [news_id])
+            
+    def mark_news_delivered_bulk(self, user_id: str, news_ids: list, touch_last_delivery: bool = False):
+        """Mark several news items as delivered to a user in one transaction, optionally stamping last_delivery too."""
         try:
             # Convert telegram user_id to database user_id
             db_user_id = self._get_db_user_id(user_id)
             if not db_user_id:
                 return False
             
-            self.cursor.execute(
-                "INSERT OR IGNORE INTO news_delivery (user_id, news_id) VALUES (?, ?)",
-                (db_user_id, news_id)
-            )
-            self.conn.commit()
+            with self.conn:
+                self.cursor.executemany(
+                    _SQL_MARK_DELIVERED,
+                    [(db_user_id, news_id) for news_id in news_ids]
+                )
+                if touch_last_delivery:
+                    self.cursor.execute(_SQL_UPDATE_LAST_DELIVERY, (db_user_id,))
             return True
         except Exception as e:
             self.logger.error(f"Error marking news as delivered: {str(e)}")
-            self.conn.rollback()
             return False
             
+    def get_users_due_for_delivery(self):
+        """Get users with automatic delivery enabled whose delivery interval has elapsed."""
+        try:
+            # last_delivery is stored by CURRENT_TIMESTAMP, so compare in SQLite's UTC clock
+            self.cursor.execute("""
+                SELECT us.user_id, us.interval_minutes, us.last_delivery, u.username
+                FROM user_schedule us
+                JOIN users u ON us.user_id = u.user_id
+                WHERE us.enabled = 1
+                  AND (us.last_delivery IS NULL
+                       OR datetime(us.last_delivery, '+' || us.interval_minutes || ' minutes') <= CURRENT_TIMESTAMP)
+            """)
+            return self.cursor.fetchall()
+        except Exception as e:
+            self.logger.error(f"Error getting scheduled users: {str(e)}")
+            return []
+            
     def get_user_schedule(self, user_id: str):
         """Get user's news delivery schedule."""
         try:
@@ -354,11 +692,11 @@ class NewsManager:
                 }
             
             # If no schedule exists, create default
-            self.cursor.execute("""
-                INSERT INTO user_schedule (user_id, enabled, interval_minutes)
-                VALUES (?, ?, ?)
-            """, (db_user_id, False, 60))
-            self.conn.commit()
+            with self.conn:
+                self.cursor.execute("""
+                    INSERT INTO user_schedule (user_id, enabled, interval_minutes)
+                    VALUES (?, ?, ?)
+                """, (db_user_id, False, 60))
             
             return {
                 'enabled': False,
@@ -382,23 +720,16 @@ class NewsManager:
                 self.logger.warning(f"Invalid interval: {interval_minutes}")
                 return False
             
-            self.cursor.execute("""
-                UPDATE user_schedule
-                SET interval_minutes = ?
-                WHERE user_id = ?
-            """, (interval_minutes, db_user_id))
-            
-            if self.cursor.rowcount == 0:
+            # Create the schedule row or update the existing one in a single statement
+            with self.conn:
                 self.cursor.execute("""
                     INSERT INTO user_schedule (user_id, interval_minutes, enabled)
-                    VALUES (?, ?, ?)
-                """, (db_user_id, interval_minutes, False))
-                
-            self.conn.commit()
+                    VALUES (?, ?, 0)
+                    ON CONFLICT(user_id) DO UPDATE SET interval_minutes = excluded.interval_minutes
+                """, (db_user_id, interval_minutes))
             return True
         except Exception as e:
             self.logger.error(f"Error setting schedule: {str(e)}")
-            self.conn.rollback()
             return False
             
     def enable_auto_delivery(self, user_id: str):
@@ -409,24 +740,18 @@ class NewsManager:
             if not db_user_id:
                 return False
             
-            self.cursor.execute("""
-                UPDATE user_schedule
-                SET enabled = 1,
-                    last_delivery = CURRENT_TIMESTAMP
-                WHERE user_id = ?
-            """, (db_user_id,))
-            
-            if self.cursor.rowcount == 0:
+            # Create the schedule row or update the existing one in a single statement
+            with self.conn:
                 self.cursor.execute("""
                     INSERT INTO user_schedule (user_id, enabled, interval_minutes, last_delivery)
                     VALUES (?, 1, 60, CURRENT_TIMESTAMP)
+                    ON CONFLICT(user_id) DO UPDATE SET
+                        enabled = 1,
+                        last_delivery = CURRENT_TIMESTAMP
                 """, (db_user_id,))
-                
-            self.conn.commit()
             return True
         except Exception as e:
             self.logger.error(f"Error enabling auto delivery: {str(e)}")
-            self.conn.rollback()
             return False
             
     def disable_auto_delivery(self, user_id: str):
@@ -437,17 +762,15 @@ class NewsManager:
             if not db_user_id:
                 return False
             
-            self.cursor.execute("""
-                UPDATE user_schedule
-                SET enabled = 0
-                WHERE user_id = ?
-            """, (db_user_id,))
-            
-            self.conn.commit()
+            with self.conn:
+                self.cursor.execute("""
+                    UPDATE user_schedule
+                    SET enabled = 0
+                    WHERE user_id = ?
+                """, (db_user_id,))
             return True
         except Exception as e:
             self.logger.error(f"Error disabling auto delivery: {str(e)}")
-            self.conn.rollback()
             return False
             
     def update_last_delivery(self, user_id: str):
@@ -458,55 +781,59 @@ class NewsManager:
             if not db_user_id:
                 return False
             
-            self.cursor.execute("""
-                UPDATE user_schedule
-                SET last_delivery = CURRENT_TIMESTAMP
-                WHERE user_id = ?
-            """, (db_user_id,))
-            
-            self.conn.commit()
+            with self.conn:
+                self.cursor.execute(_SQL_UPDATE_LAST_DELIVERY, (db_user_id,))
             return True
         except Exception as e:
             self.logger.error(f"Error updating last delivery: {str(e)}")
-            self.conn.rollback()
             return False
             
     def _get_db_user_id(self, telegram_user_id: str):
         """Convert Telegram user ID to database user ID."""
+        cached = self._uid_cache.get(str(telegram_user_id))
+        if cached is not None:
+            return cached
+        
         try:
-            # First try to find by username that matches the telegram_user_id
-            self.cursor.execute("SELECT user_id FROM users WHERE username = ?", (f"user_{telegram_user_id}",))
-            result = self.cursor.fetchone()
-            
-            if result:
-                return result[0]
-            
-            # If not found by username, try with the email placeholder
-            self.cursor.execute("SELECT user_id FROM users WHERE email = ?", (f"{telegram_user_id}@telegram.user",))
-            result = self.cursor.fetchone()
-            
-            if result:
-                return result[0]
-            
-            # If still not found, try to add the user
-            try:
-                return self.add_user(telegram_user_id, f"user_{telegram_user_id}")
-            except Exception as e:
-                self.logger.error(f"Error adding user in _get_db_user_id: {str(e)}")
-                return None
+            db_user_id = self._lookup_db_user_id(telegram_user_id)
+            if db_user_id:
+                self._uid_cache[str(telegram_user_id)] = db_user_id
+            return db_user_id
         except Exception as e:
             self.logger.error(f"Error getting DB user ID: {str(e)}")
             return None
             
+    def _lookup_db_user_id(self, telegram_user_id: str):
+        """Look up (or create) the database user ID for a Telegram user ID."""
+        # First try to find by username that matches the telegram_user_id
+        self.cursor.execute(_SQL_GET_USER_BY_USERNAME, (f"user_{telegram_user_id}",))
+        result = self.cursor.fetchone()
+        
+        if result:
+            return result[0]
+        
+        # If not found by username, try with the email placeholder
+        self.cursor.execute(_SQL_GET_USER_BY_EMAIL, (f"{telegram_user_id}@telegram.user",))
+        result = self.cursor.fetchone()
+        
+        if result:
+            return result[0]
+        
+        # If still not found, try to add the user
+        try:
+            return self.add_user(telegram_user_id, f"user_{telegram_user_id}")
+        except Exception as e:
+            self.logger.error(f"Error adding user in _get_db_user_id: {str(e)}")
+            return None
+            
     def _extract_feed_name(self, url: str) -> str:
         """Extract a readable feed name from URL."""
         # Remove protocol
-        import re
-        name = re.sub(r'^https?://', '', url)
+        name = _RE_PROTOCOL.sub('', url)
         # Remove www. if present
-        name = re.sub(r'^www\.', '', name)
+        name = _RE_WWW.sub('', name)
         # Remove path after domain
-        name = re.sub(r'/.*$', '', name)
+        name = _RE_PATH.sub('', name)
         # Capitalize first letters
         parts = name.split('.')
         if len(parts) > 1:
@@ -521,67 +848,143 @@ class NewsManager:
             print("Text length:", len(text))
             print("Language:", language)
             
+            # Get appropriate voice for the language
+            voice = self._get_voice_for_language(language)
+            print("Using voice:", voice)
+            
+            # Voice files are keyed by what is spoken, so repeated text (syndicated
+            # headlines, identical descriptions) is synthesized only once
+            content_hash = hashlib.sha256(f"{voice}\0{text}".encode('utf-8')).hexdigest()
+            
             # Check if voice file already exists
-            self.cursor.execute("""
-                SELECT file_path FROM voice_files 
-                WHERE news_id = ? AND language = ?
-            """, (news_id, language))
+            self.cursor.execute(
+                "SELECT file_path FROM voice_files WHERE content_hash = ? LIMIT 1",
+                (content_hash,)
+            )
             
             result = self.cursor.fetchone()
-            if result:
+            if result and os.path.exists(result[0]):
                 print("Found existing voice file:", result[0])
                 return result[0]
             
-            # Generate voice file
-            voice_file = os.path.join(self.voice_dir, f"news_{news_id}_{language}.mp3")
-            print("Generating voice file at:", voice_file)
-            
-            # Get appropriate voice for the language
-            voice = self._get_voice_for_language(language)
-            print("Using voice:", voice)
-            
-            # Synthesize voice using async
-            success = await self.tts.synthesize_async(text, voice_file, voice=voice)
-            if success:
-                print("Voice synthesis successful")
-                # Store voice file info in database
-                self.cursor.execute("""
-                    INSERT INTO voice_files (news_id, language, file_path)
-                    VALUES (?, ?, ?)
-                """, (news_id, language, voice_file))
-                self.conn.commit()
-                return voice_file
-            print("Voice synthesis failed")
-            return None
+            # Join a synthesis of the same text that is already running
+            task = self._voice_tasks.get(content_hash)
+            if task is None:
+                task = asyncio.ensure_future(
+                    self._synthesize_voice_file(news_id, text, language, voice, content_hash)
+                )
+                self._voice_tasks[content_hash] = task
+                task.add_done_callback(lambda _: self._voice_tasks.pop(content_hash, None))
+            # shield: one caller being cancelled must not cancel the synthesis for the others
+            return await asyncio.shield(task)
             
         except Exception as e:
             print("Error in get_voice_file:", str(e))
             self.logger.error(f"Error getting/generating voice file: {str(e)}")
             return None
             
+    async def _synthesize_voice_file(self, news_id: int, text: str, language: str, voice: str, content_hash: str) -> str:
+        """Synthesize a voice file and record it in voice_files."""
+        # Generate voice file
+        voice_file = os.path.join(self.voice_dir, f"voice_{content_hash[:16]}.mp3")
+        print("Generating voice file at:", voice_file)
+        
+        # Synthesize into a temporary file and move it into place once complete,
+        # so a half-written mp3 is never found under the final name
+        temp_file = f"{voice_file}.part"
+        success = await self.tts.synthesize_async(text, temp_file, voice=voice)
+        if not success:
+            print("Voice synthesis failed")
+            if os.path.exists(temp_file):
+                os.remove(temp_file)
+            return None
+        os.replace(temp_file, voice_file)
+        print("Voice synthesis successful")
+        
+        # Store voice file info in database
+        # (OR IGNORE: the row survives if only the file was missing)
+        with self.conn:
+            self.cursor.execute("""
+                INSERT OR IGNORE INTO voice_files (news_id, language, file_path, content_hash)
+                VALUES (?, ?, ?, ?)
+            """, (news_id, language, voice_file, content_hash))
+        return voice_file
+            
     def _get_voice_for_language(self, language: str) -> str:
         """Get appropriate voice for the given language."""
-        # Map of language codes to EdgeTTS voices
-        # https://gist.github.com/BettyJJ/17cbaa1de96235a7f5773b8690a20462
-        voice_map = {
-            'en': 'en-US-AriaNeural',  # English
-            'es': 'es-ES-AlvaroNeural',  # Spanish
-            'fr': 'fr-FR-DeniseNeural',  # French
-            'de': 'de-DE-KatjaNeural',  # German
-            'it': 'it-IT-ElsaNeural',  # Italian
-            'pt': 'pt-BR-FranciscaNeural',  # Portuguese
-            'ru': 'ru-RU-SvetlanaNeural',  # Russian
-            'zh': 'zh-CN-XiaoxiaoNeural',  # Chinese
-            'ja': 'ja-JP-NanamiNeural',  # Japanese
-            'ar': 'ar-SA-ZariyahNeural',  # Arabic
-            'fa': 'fa-IR-FaridNeural',  # Persian
-        }
-        return voice_map.get(language, 'en-US-AriaNeural')  # Default to English if language not supported
+        return _VOICE_MAP.get(language, 'en-US-AriaNeural')  # Default to English if language not supported
 
+    def prune_old_news(self, days: int = NEWS_RETENTION_DAYS) -> int:
+        """Delete news items stored more than `days` days ago, along with their deliveries and voice files.
+        
+        Pruned links are remembered for PRUNED_LINK_RETENTION_DAYS and then forgotten too.
+        """
+        try:
+            total_deleted = 0
+            while True:
+                with self.conn:
+                    self.conn.execute("BEGIN IMMEDIATE")
+                    news_ids = [row[0] for row in self.cursor.execute(
+                        "SELECT news_id FROM news_items WHERE created_at < datetime('now', ?) LIMIT ?",
+                        (f'-{int(days)} days', _NEWS_PRUNE_CHUNK)
+                    )]
+                    if not news_ids:
+                        break
+                    placeholders = ",".join("?" * len(news_ids))
+                    voice_paths = [row[0] for row in self.cursor.execute(
+                        f"SELECT file_path FROM voice_files WHERE news_id IN ({placeholders})", news_ids
+                    )]
+                    # Remember the links so feeds that still carry these items don't store them again
+                    self.cursor.execute(
+                        "INSERT OR IGNORE INTO pruned_links (link, pruned_at) "
+                        f"SELECT link, CURRENT_TIMESTAMP FROM news_items WHERE news_id IN ({placeholders})",
+                        news_ids
+                    )
+                    # news_delivery and voice_files rows go with them through ON DELETE CASCADE
+                    self.cursor.execute(f"DELETE FROM news_items WHERE news_id IN ({placeholders})", news_ids)
+                total_deleted += len(news_ids)
+                
+                for path in voice_paths:
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+            
+            # By now feeds have dropped links pruned this long ago
+            with self.conn:
+                self.cursor.execute(
+                    "DELETE FROM pruned_links WHERE pruned_at < datetime('now', ?)",
+                    (f'-{PRUNED_LINK_RETENTION_DAYS} days',)
+                )
+            
+            # Refresh planner statistics now that the tables have shrunk
+            self.conn.execute("PRAGMA optimize")
+            self.logger.info(f"Pruned {total_deleted} news items older than {days} days")
+            return total_deleted
+        except Exception as e:
+            self.logger.error(f"Error pruning old news: {str(e)}")
+            return 0
+            
+    async def prune_old_news_async(self, days: int = NEWS_RETENTION_DAYS) -> int:
+        """Prune old news items without blocking the event loop."""
+        return await asyncio.to_thread(self.prune_old_news, days)
+    
     def close(self):
-        """Close the database connection."""
-        if self.conn:
-            self.conn.close()
+        """Close the fetch and parse pools, the HTTP session and the database connections of all threads."""
+        self._fetch_pool.shutdown(wait=True)
+        if self._parse_pool is not None:
+            self._parse_pool.shutdown(wait=True)
+        self._http.close()
+        with self._connections_lock:
+            for conn in self._connections:
+                # Refresh planner statistics for the indexes this connection used
+                try:
+                    conn.execute("PRAGMA optimize")
+                except sqlite3.Error:
+                    pass
+                conn.close()
+            self._connections.clear()
+        self._local = threading.local()
 
     def get_user_language(self, user_id: str) -> str:
         """Get user's preferred language."""
@@ -590,10 +993,7 @@ class NewsManager:
             if not db_user_id:
                 return 'en'
             
-            self.cursor.execute(
-                "SELECT preferred_language FROM user_preferences WHERE user_id = ?",
-                (db_user_id,)
-            )
+            self.cursor.execute(_SQL_GET_USER_LANGUAGE, (db_user_id,))
             result = self.cursor.fetchone()
             return result[0] if result else 'en'
         except Exception as e:
@@ -607,22 +1007,16 @@ class NewsManager:
             if not db_user_id:
                 return False
             
-            self.cursor.execute(
-                "UPDATE user_preferences SET preferred_language = ? WHERE user_id = ?",
-                (language_code, db_user_id)
-            )
-            
-            if self.cursor.rowcount == 0:
-                self.cursor.execute(
-                    "INSERT INTO user_preferences (user_id, preferred_language) VALUES (?, ?)",
-                    (db_user_id, language_code)
-                )
-            
-            self.conn.commit()
+            # Create the preferences row or update the existing one in a single statement
+            with self.conn:
+                self.cursor.execute("""
+                    INSERT INTO user_preferences (user_id, preferred_language)
+                    VALUES (?, ?)
+                    ON CONFLICT(user_id) DO UPDATE SET preferred_language = excluded.preferred_language
+                """, (db_user_id, language_code))
             return True
         except Exception as e:
             self.logger.error(f"Error setting user language: {str(e)}")
-            self.conn.rollback()
             return False
 
     def get_user_preferences(self, user_id: str) -> dict:
@@ -638,10 +1032,7 @@ class NewsManager:
                     'voice_language': 'auto'
                 }
             
-            self.cursor.execute("""
-                SELECT preferred_language, enable_translation, max_news_items, enable_voice, voice_language
-                FROM user_preferences WHERE user_id = ?
-            """, (db_user_id,))
+            self.cursor.execute(_SQL_GET_USER_PREFERENCES, (db_user_id,))
             result = self.cursor.fetchone()
             
             if result:
@@ -676,28 +1067,18 @@ class NewsManager:
             if not db_user_id:
                 return False
             
-            self.cursor.execute("""
-                UPDATE user_preferences 
-                SET preferred_language = ?,
-                    enable_translation = ?,
-                    max_news_items = ?,
-                    enable_voice = ?,
-                    voice_language = ?
-                WHERE user_id = ?
-            """, (
-                preferences.get('preferred_language', 'en'),
-                preferences.get('enable_translation', True),
-                preferences.get('max_news_items', 5),
-                preferences.get('enable_voice', True),
-                preferences.get('voice_language', 'auto'),
-                db_user_id
-            ))
-            
-            if self.cursor.rowcount == 0:
+            # Create the preferences row or update the existing one in a single statement
+            with self.conn:
                 self.cursor.execute("""
-                    INSERT INTO user_preferences 
+                    INSERT INTO user_preferences
                     (user_id, preferred_language, enable_translation, max_news_items, enable_voice, voice_language)
                     VALUES (?, ?, ?, ?, ?, ?)
+                    ON CONFLICT(user_id) DO UPDATE SET
+                        preferred_language = excluded.preferred_language,
+                        enable_translation = excluded.enable_translation,
+                        max_news_items = excluded.max_news_items,
+                        enable_voice = excluded.enable_voice,
+                        voice_language = excluded.voice_language
                 """, (
                     db_user_id,
                     preferences.get('preferred_language', 'en'),
@@ -706,12 +1087,9 @@ class NewsManager:
                     preferences.get('enable_voice', True),
                     preferences.get('voice_language', 'auto')
                 ))
-            
-            self.conn.commit()
             return True
         except Exception as e:
             self.logger.error(f"Error updating user preferences: {str(e)}")
-            self.conn.rollback()
             return False
 
     def set_voice_enabled(self, user_id: str, enabled: bool) -> bool:
@@ -11,7 +11,10 @@ CREATE TABLE IF NOT EXISTS rss_feeds (
     feed_id INTEGER PRIMARY KEY AUTOINCREMENT,
     feed_url TEXT NOT NULL UNIQUE,
     feed_name TEXT NOT NULL,
-    last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    etag TEXT,
+    modified TEXT,
+    language TEXT
 );
 
 -- User-RSS mapping table to track which users subscribe to which feeds
@@ -73,6 +76,29 @@ CREATE TABLE IF NOT EXISTS voice_files (
     news_id INTEGER,
     language TEXT NOT NULL,
     file_path TEXT NOT NULL UNIQUE,
+    content_hash TEXT,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     FOREIGN KEY (news_id) REFERENCES news_items(news_id) ON DELETE CASCADE
-); 
\ No newline at end of file
+); 
+
+-- Links of news items deleted by prune_old_news, so feeds that still carry them don't store them again
+-- (kept for PRUNED_LINK_RETENTION_DAYS, by when feeds have dropped them)
+CREATE TABLE IF NOT EXISTS pruned_links (
+    link TEXT PRIMARY KEY,
+    pruned_at TIMESTAMP
+) WITHOUT ROWID;
+
+-- Index for per-feed news lookups ordered by publication date
+-- (news_delivery(user_id, news_id) and user_feeds(user_id, feed_id) are already
+-- covered by their UNIQUE / PRIMARY KEY constraints)
+CREATE INDEX IF NOT EXISTS idx_news_feed_pub ON news_items(feed_id, pub_date DESC);
+
+-- news_delivery's UNIQUE(user_id, news_id) can't serve lookups by news_id alone,
+-- which foreign-key cascades from news_items need
+CREATE INDEX IF NOT EXISTS idx_delivery_news ON news_delivery(news_id);
+
+-- Same for voice_files: cascades from news_items and prune_old_news look it up by news_id
+CREATE INDEX IF NOT EXISTS idx_voice_news ON voice_files(news_id);
+
+-- Partial index for the scheduler's "WHERE enabled = 1" scan; it only holds users with delivery on
+CREATE INDEX IF NOT EXISTS idx_schedule_enabled ON user_schedule(user_id) WHERE enabled = 1;
@@ -12,7 +12,6 @@ from telegram.ext import (
 from news_manager import NewsManager
 from llm_manager import LLMManager
 import os
-from datetime import datetime, timedelta
 import asyncio
 import re
 from bs4 import BeautifulSoup
@@ -40,6 +39,21 @@ TELEGRAM_BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
 if not TELEGRAM_BOT_TOKEN:
     raise ValueError("TELEGRAM_BOT_TOKEN environment variable is not set")
 
+# langdetect samples n-grams at random; a fixed seed keeps results repeatable
+langdetect.DetectorFactory.seed = 0
+
+# Characters of text passed to langdetect; a few sentences identify the language,
+# and its cost grows with the length of the input
+LANGDETECT_MAX_CHARS = 300
+
+# Users the scheduler delivers to at the same time. This bounds sends in flight, not the
+# rate; when Telegram's flood control (about 30 messages per second) answers with
+# RetryAfter, the send waits the requested time and is retried
+SCHEDULED_DELIVERY_CONCURRENCY = 20
+
+# Attempts per message before a RetryAfter is given up on
+FLOOD_CONTROL_ATTEMPTS = 3
+
 # Constants for ConversationHandler states
 CHOOSING_LANGUAGE, ENTERING_FEED_URL, CONFIRMING_REMOVAL, SETTING_SCHEDULE = range(4)
 
@@ -340,8 +354,8 @@ async def get_news_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Get latest news from subscribed feeds."""
     user_id = str(update.effective_user.id)
     
-    # First, check for new content in all feeds
-    news_manager.check_feeds()
+    # First, check for new content in all feeds (off the event loop, it does network I/O)
+    await news_manager.check_feeds_async()
     
     # Get undelivered news for user
     news_items = news_manager.get_undelivered_news(user_id)
@@ -363,69 +377,84 @@ async def get_news_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     voice_status = news_manager.get_user_preferences(user_id)["enable_voice"]
     translation_status = news_manager.get_user_preferences(user_id)["enable_translation"]
 
-    # Process and send each news item
+    # Use the language the feed declares; only detect it when the feed has none
+    source_languages = {}
     for item in news_items:
-        # Detect source language
-        source_language = detect_language(item['description'])
+        source_language = item['feed_language']
+        if source_language not in SUPPORTED_LANGUAGES:
+            source_language = detect_language(item['description'])
+        source_languages[item['news_id']] = source_language
+    
+    # Translate all items up front and concurrently instead of one LLM round trip per item
+    translations = {}
+    if translation_status:
+        translations = await translate_descriptions(news_items, source_languages, user_language)
+
+    # Process and send each news item
+    delivered_ids = []
+    completed = False
+    try:
+        for item in news_items:
+            source_language = source_languages[item['news_id']]
         
-        # Prepare news message
-        news_message = f"📰 *{item['title']}*\n\n"
+            # Prepare news message
+            news_message = f"📰 *{item['title']}*\n\n"
         
-        # Check if translation is needed
-        if translation_status and source_language != user_language:
-            try:
-                # Translate using LLM
-                translated_description = await llm_manager.translate_text(
-                    item['description'], 
-                    source_language, 
-                    user_language
-                )
-                news_message += f"{translated_description}\n\n"
-                news_message += f"🌐 *Translated from {SUPPORTED_LANGUAGES.get(source_language, source_language)}*\n\n"
+            # Check if translation is needed
+            if translation_status and source_language != user_language:
+                try:
+                    # Translated using LLM before the loop
+                    translated_description = translations[item['news_id']]
+                    if isinstance(translated_description, Exception):
+                        raise translated_description
+                    news_message += f"{translated_description}\n\n"
+                    news_message += f"🌐 *Translated from {SUPPORTED_LANGUAGES.get(source_language, source_language)}*\n\n"
                 
-                # Generate voice for translated text
-                if voice_status:
-                    voice_file = await news_manager.get_voice_file(item['news_id'], translated_description, user_language)
-            except Exception as e:
-                logger.error(f"Translation error: {e}")
+                    # Generate voice for translated text
+                    if voice_status:
+                        voice_file = await news_manager.get_voice_file(item['news_id'], translated_description, user_language)
+                except Exception as e:
+                    logger.error(f"Translation error: {e}")
+                    news_message += f"{item['description']}\n\n"
+                    news_message += "⚠️ *Translation failed*\n\n"
+                    # Generate voice for original text
+                    if voice_status:
+                        voice_file = await news_manager.get_voice_file(item['news_id'], item['description'], source_language)
+            else:
                 news_message += f"{item['description']}\n\n"
-                news_message += "⚠️ *Translation failed*\n\n"
                 # Generate voice for original text
                 if voice_status:
                     voice_file = await news_manager.get_voice_file(item['news_id'], item['description'], source_language)
-        else:
-            news_message += f"{item['description']}\n\n"
-            # Generate voice for original text
-            if voice_status:
-                voice_file = await news_manager.get_voice_file(item['news_id'], item['description'], source_language)
         
-        news_message += f"Source: {item['feed_name']}\n"
-        news_message += f"Link: {item['link']}"
+            news_message += f"Source: {item['feed_name']}\n"
+            news_message += f"Link: {item['link']}"
         
-        # Send message with voice if available
-        if voice_status and voice_file and os.path.exists(voice_file):
-            with open(voice_file, 'rb') as voice:
-                # Create media group with text and voice
-                media_group = [
-                    InputMediaAudio(
-                        media=voice,
-                        caption=news_message,
-                        parse_mode='Markdown'
+            # Send message with voice if available
+            if voice_status and voice_file and os.path.exists(voice_file):
+                with open(voice_file, 'rb') as voice:
+                    # Create media group with text and voice
+                    media_group = [
+                        InputMediaAudio(
+                            media=voice,
+                            caption=news_message,
+                            parse_mode='Markdown'
+                        )
+                    ]
+                    await context.bot.send_media_group(
+                        chat_id=user_id,
+                        media=media_group
                     )
-                ]
-                await context.bot.send_media_group(
-                    chat_id=user_id,
-                    media=media_group
-                )
-        else:
-            # If no voice file, just send text
-            await update.message.reply_text(news_message, parse_mode='Markdown')
+            else:
+                # If no voice file, just send text
+                await update.message.reply_text(news_message, parse_mode='Markdown')
         
-        # Mark as delivered
-        news_manager.mark_news_delivered(user_id, item['news_id'])
-    
-    # Update last delivery time
-    news_manager.update_last_delivery(user_id)
+            delivered_ids.append(item['news_id'])
+        completed = True
+    finally:
+        # Mark everything that was sent as delivered, and update the last delivery time
+        # once the whole batch went out, in one transaction
+        if delivered_ids or completed:
+            news_manager.mark_news_delivered_bulk(user_id, delivered_ids, touch_last_delivery=completed)
     
     await update.message.reply_text(
         f"✅ Delivered {len(news_items)} news items. Use /getnews again later for more updates."
@@ -763,7 +792,7 @@ def detect_language(text: str) -> str:
             text = soup.get_text()
         
         # Detect language using langdetect
-        detected = langdetect.detect(text)
+        detected = langdetect.detect(text[:LANGDETECT_MAX_CHARS])
         return detected if detected in SUPPORTED_LANGUAGES else 'en'
     except Exception as e:
         logger.error(f"Language detection error: {e}")
@@ -777,6 +806,32 @@ def set_user_language(user_id: str, language_code: str) -> bool:
     """Set user's preferred language in database."""
     return news_manager.set_user_language(user_id, language_code)
 
+async def translate_descriptions(news_items, source_languages, target_language):
+    """Translate the descriptions of news items concurrently, one translate_many call per source language.
+    
+    Returns a dict of news_id -> translated text, or the exception if that language's batch failed.
+    """
+    by_language = {}
+    for item in news_items:
+        source_language = source_languages[item['news_id']]
+        if source_language != target_language:
+            by_language.setdefault(source_language, []).append(item)
+    
+    languages = list(by_language)
+    results = await asyncio.gather(
+        *(
+            llm_manager.translate_many([item['description'] for item in by_language[language]], language, target_language)
+            for language in languages
+        ),
+        return_exceptions=True
+    )
+    
+    translations = {}
+    for language, result in zip(languages, results):
+        for index, item in enumerate(by_language[language]):
+            translations[item['news_id']] = result if isinstance(result, Exception) else result[index]
+    return translations
+
 async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handle errors in the bot."""
     logger.error(f"Exception while handling an update: {context.error}")
@@ -797,86 +852,112 @@ async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
             "Sorry, an error occurred while processing your request. Please try again later."
         )
 
-async def check_and_deliver_news(context: ContextTypes.DEFAULT_TYPE):
-    """Check for and deliver news to users based on their schedules."""
+async def send_with_flood_retry(send):
+    """Await send(), waiting out Telegram's flood control and retrying when it answers with RetryAfter."""
+    for attempt in range(1, FLOOD_CONTROL_ATTEMPTS + 1):
+        try:
+            return await send()
+        except RetryAfter as e:
+            if attempt == FLOOD_CONTROL_ATTEMPTS:
+                raise
+            logger.warning(f"Flood control exceeded, retrying in {e.retry_after} seconds")
+            await asyncio.sleep(e.retry_after)
+
+async def deliver_news_to_user(context: ContextTypes.DEFAULT_TYPE, user_id):
+    """Send a user's undelivered news in order and record the delivery."""
+    # Get undelivered news for user
+    news_items = news_manager.get_undelivered_news(str(user_id))
+    
+    if not news_items:
+        return
+    
+    # Limit to 5 news items per interval
+    news_items = news_items[:5]
+    
+    # Get user's preferences
+    preferences = news_manager.get_user_preferences(str(user_id))
+    user_language = preferences['preferred_language']
+    enable_voice = preferences['enable_voice']
+    voice_language = preferences['voice_language']
+    
+    # Send each news item
+    delivered_ids = []
+    completed = False
     try:
-        # Get all users with enabled schedules
-        news_manager.cursor.execute("""
-            SELECT us.user_id, us.interval_minutes, us.last_delivery, u.username
-            FROM user_schedule us
-            JOIN users u ON us.user_id = u.user_id
-            WHERE us.enabled = 1
-        """)
-        users = news_manager.cursor.fetchall()
-        
-        for user_id, interval_minutes, last_delivery, username in users:
-            # Check if it's time to deliver news
-            if last_delivery:
-                last_delivery_time = datetime.strptime(last_delivery, '%Y-%m-%d %H:%M:%S')
-                next_delivery_time = last_delivery_time + timedelta(minutes=interval_minutes)
-                if datetime.now() < next_delivery_time:
-                    continue
-            
-            # Get undelivered news for user
-            news_items = news_manager.get_undelivered_news(str(user_id))
-            
-            if not news_items:
-                continue
+        for news in news_items:
+            # Format news message
+            message = (
+                f"📰 *{news['title']}*\n\n"
+                f"{news['description']}\n\n"
+                f"Source: {news['feed_name']}\n"
+                f"Published: {news['pub_date']}\n"
+                f"[Read more]({news['link']})"
+            )
             
-            # Limit to 5 news items per interval
-            news_items = news_items[:5]
+            # Start voice synthesis first so it runs while the text message is sent
+            print("enable_voice")
+            print(enable_voice)
+            voice_task = None
+            if enable_voice:
+                print("enable_voice true")
+                # Use specified voice language or auto-detect
+                voice_lang = voice_language if voice_language != 'auto' else user_language
+                print("voice_lang")
+                print(voice_lang)
+                # Combine title and description for voice
+                voice_text = f"{news['title']}. {news['description']}"
+                voice_task = asyncio.create_task(
+                    news_manager.get_voice_file(news['news_id'], voice_text, voice_lang)
+                )
             
-            # Get user's preferences
-            preferences = news_manager.get_user_preferences(str(user_id))
-            user_language = preferences['preferred_language']
-            enable_voice = preferences['enable_voice']
-            voice_language = preferences['voice_language']
+            # Send text message
+            await send_with_flood_retry(lambda: context.bot.send_message(
+                chat_id=user_id,
+                text=message,
+                parse_mode='Markdown',
+                disable_web_page_preview=True
+            ))
             
-            # Send each news item
-            for news in news_items:
-                # Format news message
-                message = (
-                    f"📰 *{news['title']}*\n\n"
-                    f"{news['description']}\n\n"
-                    f"Source: {news['feed_name']}\n"
-                    f"Published: {news['pub_date']}\n"
-                    f"[Read more]({news['link']})"
-                )
-                
-                # Send text message
-                await context.bot.send_message(
-                    chat_id=user_id,
-                    text=message,
-                    parse_mode='Markdown',
-                    disable_web_page_preview=True
-                )
-                
-                # Generate and send voice message if enabled
-                print("enable_voice")
-                print(enable_voice)
-                if enable_voice:
-                    print("enable_voice true")
-                    # Use specified voice language or auto-detect
-                    voice_lang = voice_language if voice_language != 'auto' else user_language
-                    print("voice_lang")
-                    print(voice_lang)
-                    # Combine title and description for voice
-                    voice_text = f"{news['title']}. {news['description']}"
-                    voice_file = news_manager.get_voice_file(news['news_id'], voice_text, voice_lang)
-                    if voice_file and os.path.exists(voice_file):
+            # Send voice message once synthesis has finished
+            if voice_task:
+                voice_file = await voice_task
+                if voice_file and os.path.exists(voice_file):
+                    async def send_voice():
+                        # Reopened on every attempt, since a failed upload has already read the file
                         with open(voice_file, 'rb') as voice:
-                            await context.bot.send_voice(
+                            return await context.bot.send_voice(
                                 chat_id=user_id,
                                 voice=voice,
                                 caption=f"🎧 Voice version of: {news['title']}"
                             )
-                
-                # Mark news as delivered
-                news_manager.mark_news_delivered(str(user_id), news['news_id'])
-            
-            # Update last delivery time
-            news_manager.update_last_delivery(str(user_id))
+                    await send_with_flood_retry(send_voice)
             
+            delivered_ids.append(news['news_id'])
+        completed = True
+    finally:
+        # Mark everything that was sent as delivered, and update the last delivery time
+        # once the whole batch went out, in one transaction
+        if delivered_ids or completed:
+            news_manager.mark_news_delivered_bulk(str(user_id), delivered_ids, touch_last_delivery=completed)
+
+async def check_and_deliver_news(context: ContextTypes.DEFAULT_TYPE):
+    """Check for and deliver news to users based on their schedules."""
+    try:
+        # Get users with enabled schedules whose next delivery is due
+        users = news_manager.get_users_due_for_delivery()
+        
+        # Deliver to different users concurrently; each user's items still go out one by one,
+        # since Telegram throttles messages per chat
+        semaphore = asyncio.Semaphore(SCHEDULED_DELIVERY_CONCURRENCY)
+        
+        async def deliver(user_id):
+            async with semaphore:
+                try:
+                    await deliver_news_to_user(context, user_id)
+                except Exception as e:
+                    logging.error(f"Error delivering news to user {user_id}: {str(e)}")
+        
+        await asyncio.gather(*(deliver(user_id) for user_id, _, _, _ in users))
     except Exception as e:
         logging.error(f"Error in check_and_deliver_news: {str(e)}")
 
@@ -888,8 +969,15 @@ def start_scheduler(application: Application):
         except Exception as e:
             logger.error(f"Error in scheduler: {e}")
     
+    async def run_housekeeping(context: ContextTypes.DEFAULT_TYPE):
+        try:
+            await news_manager.prune_old_news_async()
+        except Exception as e:
+            logger.error(f"Error in housekeeping: {e}")
+    
     # Create a new task in the application's event loop
     application.job_queue.run_repeating(run_scheduler, interval=300, first=0)  # Run every 5 minutes
+    application.job_queue.run_repeating(run_housekeeping, interval=86400, first=3600)  # Run once a day
 
 def main():
     """Start the bot."""